@@ -5,10 +5,76 @@ Provides a wrapper around Azure OpenAI to generate conversation titles or other
 """
 
 import logging
-from typing import List, Optional
+import re
+from types import MappingProxyType
+from typing import Any, ClassVar, Dict, List, Mapping, Optional, Tuple
 
+from aiolimiter import AsyncLimiter
 from openai import AsyncAzureOpenAI
+from openai.types.chat import ChatCompletion
 from .config import ConversationConfig
+from .retry import retry_title_request
+
+# Shared clients keyed by (endpoint, api_version, api_key), with the number of services using each
+_ClientKey = Tuple[str, str, str]
+_shared_clients: Dict[_ClientKey, AsyncAzureOpenAI] = {}
+_client_refcounts: Dict[_ClientKey, int] = {}
+
+# Shared request-rate limiters keyed by (endpoint, deployment), so every service calling the same
+# deployment draws from one requests-per-minute budget
+_shared_limiters: Dict[Tuple[str, str], AsyncLimiter] = {}
+
+# Maximum characters of conversation context sent for title generation
+TITLE_CONTEXT_MAX_CHARS = 2000
+
+# Extra completion tokens per line of a batched title response, covering the "12. " prefix,
+# the newline and a little slack, so the last titles are not cut off by max_tokens
+TITLE_LINE_OVERHEAD_TOKENS = 6
+
+# Matches a numbered line such as "3. Quarterly Sales Review" in a batched title response
+_NUMBERED_LINE = re.compile(r"^\s*(\d+)[.):]\s*(.+?)\s*$")
+
+
+def _acquire_client(endpoint: str, api_version: str, api_key: str) -> AsyncAzureOpenAI:
+    """
+    Returns the process-wide AsyncAzureOpenAI client for these settings, creating it on first use.
+    Reusing one client keeps its HTTP connection pool and TLS sessions warm across services.
+    """
+    key = (endpoint, api_version, api_key)
+    client = _shared_clients.get(key)
+    if client is None:
+        # Retries are handled by retry_title_request, so disable the SDK's own to avoid compounding them
+        client = AsyncAzureOpenAI(api_key=api_key, azure_endpoint=endpoint, api_version=api_version, max_retries=0)
+        _shared_clients[key] = client
+        _client_refcounts[key] = 0
+    _client_refcounts[key] += 1
+    return client
+
+
+def _release_client(endpoint: str, api_version: str, api_key: str) -> Optional[AsyncAzureOpenAI]:
+    """
+    Drops one reference to a shared client. Returns the client if it is no longer used and should be closed.
+    """
+    key = (endpoint, api_version, api_key)
+    if key not in _client_refcounts:
+        return None
+    _client_refcounts[key] -= 1
+    if _client_refcounts[key] > 0:
+        return None
+    del _client_refcounts[key]
+    return _shared_clients.pop(key)
+
+
+def _acquire_limiter(endpoint: str, deployment: str, rpm_limit: int) -> AsyncLimiter:
+    """
+    Returns the process-wide rate limiter for a deployment, creating it with rpm_limit on first use.
+    """
+    key = (endpoint, deployment)
+    limiter = _shared_limiters.get(key)
+    if limiter is None:
+        limiter = AsyncLimiter(max_rate=rpm_limit, time_period=60)
+        _shared_limiters[key] = limiter
+    return limiter
 
 
 class AzureOpenAIService:
@@ -17,6 +83,16 @@ class AzureOpenAIService:
     Example usage: generate a short conversation title from conversation context.
     """
 
+    # System message for single-conversation title generation, built once per process
+    _TITLE_SYSTEM_MSG: ClassVar[Mapping[str, str]] = MappingProxyType({
+        "role": "system",
+        "content": (
+            "You are a system that provides short, concise chat conversation titles. "
+            "Take the user's messages and produce a 4-word max title. No punctuation. "
+            "No quotes. If insufficient context, output 'New Chat'."
+        ),
+    })
+
     def __init__(self, config: ConversationConfig) -> None:
         """
         Args:
@@ -26,6 +102,7 @@ class AzureOpenAIService:
         self.endpoint: str = config.AZURE_OPENAI_ENDPOINT
         self.api_key: str = config.AZURE_OPENAI_API_KEY
         self.deployment_name: str = config.AZURE_OPENAI_DEPLOYMENT_NAME
+        self.title_deployment_name: str = config.AZURE_OPENAI_TITLE_DEPLOYMENT_NAME
         self.api_version: str = config.AZURE_OPENAI_API_VERSION
 
         # Configure logging
@@ -37,15 +114,16 @@ class AzureOpenAIService:
             logging.getLogger("azure.core").setLevel(logging.WARNING)
             logging.getLogger("openai").setLevel(logging.WARNING)
 
-        # Initialize the client during __init__
+        # Bound the request rate to the deployment's requests-per-minute quota, shared with other services
+        self._rate_limiter: AsyncLimiter = _acquire_limiter(
+            self.endpoint, self.title_deployment_name, config.AZURE_OPENAI_RPM_LIMIT
+        )
+
+        # Reuse the shared client for these settings during __init__
         self._client: Optional[AsyncAzureOpenAI] = None
         self.logger.info("Initializing Azure OpenAI client...")
         try:
-            self._client = AsyncAzureOpenAI(
-                api_key=self.api_key,
-                azure_endpoint=self.endpoint,
-                api_version=self.api_version
-            )
+            self._client = _acquire_client(self.endpoint, self.api_version, self.api_key)
             self.logger.info("Azure OpenAI client initialized successfully.")
         except Exception as e:
             self.logger.error("Failed to initialize Azure OpenAI client: %s", e)
@@ -64,33 +142,31 @@ class AzureOpenAIService:
             str: A short conversation title.
         """
         self.logger.info("Generating conversation title...")
-        self.logger.debug("User messages: %s", user_messages)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("User messages: %s", user_messages)
 
         if not self._client:
             self.logger.error("OpenAIService client not initialized.")
             raise RuntimeError("OpenAIService client not initialized.")
 
-        system_prompt: str = (
-            "You are a system that provides short, concise chat conversation titles. "
-            "Take the user's messages and produce a 4-word max title. No punctuation. "
-            "No quotes. If insufficient context, output 'New Chat'."
-        )
+        # Prepare messages for the OpenAI API as a single user turn; the most recent context is enough for a title
+        messages: List[dict] = [
+            dict(self._TITLE_SYSTEM_MSG),
+            {"role": "user", "content": "\n".join(user_messages)[-TITLE_CONTEXT_MAX_CHARS:]},
+        ]
 
-        # Prepare messages for the OpenAI API
-        messages: List[dict] = [{"role": "system", "content": system_prompt}]
-        for msg in user_messages:
-            messages.append({"role": "user", "content": msg})
-
-        self.logger.debug("Prepared messages for OpenAI API: %s", messages)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("Prepared messages for OpenAI API: %s", messages)
 
         try:
-            completion = await self._client.chat.completions.create(
-                model=self.deployment_name,
+            completion = await self._create_completion(
+                model=self.title_deployment_name,
                 messages=messages,
-                temperature=0.9,
-                max_tokens=20
+                temperature=0.3,
+                max_tokens=10
             )
-            self.logger.debug("OpenAI API response: %s", completion)
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("OpenAI API response: %s", completion)
 
             if completion and completion.choices:
                 raw_title: str = completion.choices[0].message.content.strip()
@@ -104,10 +180,88 @@ class AzureOpenAIService:
             self.logger.debug("Exception details:", exc_info=True)
             return "Chat"
 
+    async def generate_conversation_titles(self, batch: List[List[str]]) -> List[str]:
+        """
+        Creates short titles for several conversations with a single chat completion request.
+        Each conversation is numbered in one prompt and the numbered response lines are mapped back.
+
+        Args:
+            batch (List[List[str]]): The user messages of each conversation.
+
+        Returns:
+            List[str]: One title per conversation, in the same order. Conversations the model
+            did not title fall back to 'Chat'.
+        """
+        self.logger.info("Generating %d conversation titles...", len(batch))
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("Batched user messages: %s", batch)
+
+        if not batch:
+            return []
+
+        if not self._client:
+            self.logger.error("OpenAIService client not initialized.")
+            raise RuntimeError("OpenAIService client not initialized.")
+
+        system_prompt: str = (
+            f"You are a system that provides short, concise chat conversation titles. "
+            f"Produce {len(batch)} titles, one per line, for the {len(batch)} numbered user conversations below. "
+            "Start each line with the conversation number followed by a period, e.g. '1. Title'. "
+            "Each title is 4 words max. No punctuation. No quotes. "
+            "If a conversation has insufficient context, use 'New Chat' for it."
+        )
+        # Like the single-title prompt, keep only the most recent context of each conversation
+        conversations: str = "\n\n".join(
+            f"{index}. " + "\n".join(user_messages)[-TITLE_CONTEXT_MAX_CHARS:]
+            for index, user_messages in enumerate(batch, start=1)
+        )
+        messages: List[dict] = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": conversations},
+        ]
+
+        titles: List[str] = ["Chat"] * len(batch)
+        try:
+            completion = await self._create_completion(
+                model=self.title_deployment_name,
+                messages=messages,
+                temperature=0.3,
+                max_tokens=(10 + TITLE_LINE_OVERHEAD_TOKENS) * len(batch)
+            )
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("OpenAI API response: %s", completion)
+
+            if completion and completion.choices and completion.choices[0].message.content:
+                for line in completion.choices[0].message.content.splitlines():
+                    match = _NUMBERED_LINE.match(line)
+                    if match and 1 <= int(match.group(1)) <= len(batch):
+                        titles[int(match.group(1)) - 1] = match.group(2)
+            else:
+                self.logger.warning("No valid titles generated. Defaulting to 'Chat'.")
+        except Exception as e:
+            self.logger.error("Failed to generate conversation titles: %s", e)
+            self.logger.debug("Exception details:", exc_info=True)
+
+        self.logger.info("Generated conversation titles: %s", titles)
+        return titles
+
+    @retry_title_request
+    async def _create_completion(self, **kwargs: Any) -> ChatCompletion:
+        """
+        Issues a chat completion request within the rate limit, retrying on throttling.
+        """
+        async with self._rate_limiter:
+            return await self._client.chat.completions.create(**kwargs)
+
     async def close(self) -> None:
         """
-        Closes the underlying client session.
+        Releases this service's reference to the shared client.
+        The underlying client session is only closed once no other service is using it,
+        so this should be called when the service is no longer needed (e.g. at shutdown).
         """
         if self._client:
-            await self._client.close()  # Close the AsyncAzureOpenAI client
-            self.logger.info("Azure OpenAI client session closed.")
+            client = _release_client(self.endpoint, self.api_version, self.api_key)
+            self._client = None
+            if client:
+                await client.close()  # Close the AsyncAzureOpenAI client
+                self.logger.info("Azure OpenAI client session closed.")
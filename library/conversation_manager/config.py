@@ -6,31 +6,55 @@ All necessary credentials and configuration details should be in .env.
 """
 
 import os
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Mapping
+
 from dotenv import load_dotenv
 
 
+@lru_cache(maxsize=1)
+def _load_env() -> Mapping[str, str]:
+    """
+    Loads .env once per process and returns a read-only snapshot of the environment.
+    """
+    load_dotenv()
+    return MappingProxyType(dict(os.environ))
+
+
 class ConversationConfig:
     """
     Loads and stores configuration settings for Cosmos DB and Azure OpenAI from environment variables.
+    The environment is parsed once and shared by every instance; call reset_cache() to re-read it.
     """
     def __init__(self) -> None:
-        # Load .env if present
-        load_dotenv()
+        env = _load_env()
 
         # Cosmos DB
-        self.COSMOS_DB_ENDPOINT: str = os.getenv("COSMOS_DB_ENDPOINT", "")
-        self.COSMOS_DB_KEY: str = os.getenv("COSMOS_DB_KEY", "")
-        self.CHAT_HISTORY_DATABASE: str = os.getenv("CHAT_HISTORY_DATABASE", "ChatHistoryDB")
-        self.CHAT_HISTORY_CONTAINER: str = os.getenv("CHAT_HISTORY_CONTAINER", "Conversations")
+        self.COSMOS_DB_ENDPOINT: str = env.get("COSMOS_DB_ENDPOINT", "")
+        self.COSMOS_DB_KEY: str = env.get("COSMOS_DB_KEY", "")
+        self.CHAT_HISTORY_DATABASE: str = env.get("CHAT_HISTORY_DATABASE", "ChatHistoryDB")
+        self.CHAT_HISTORY_CONTAINER: str = env.get("CHAT_HISTORY_CONTAINER", "Conversations")
+        self.COSMOS_DB_MAX_CONNECTIONS: int = int(env.get("COSMOS_DB_MAX_CONNECTIONS", "500"))  # Connection pool size
 
         # Azure OpenAI
-        self.AZURE_OPENAI_ENDPOINT: str = os.getenv("AZURE_OPENAI_ENDPOINT", "")
-        self.AZURE_OPENAI_API_KEY: str = os.getenv("AZURE_OPENAI_API_KEY", "")
-        self.AZURE_OPENAI_DEPLOYMENT_NAME: str = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME", "")
-        self.AZURE_OPENAI_API_VERSION: str = os.getenv("AZURE_OPENAI_API_VERSION", "2024-10-15-preview")
+        self.AZURE_OPENAI_ENDPOINT: str = env.get("AZURE_OPENAI_ENDPOINT", "")
+        self.AZURE_OPENAI_API_KEY: str = env.get("AZURE_OPENAI_API_KEY", "")
+        self.AZURE_OPENAI_DEPLOYMENT_NAME: str = env.get("AZURE_OPENAI_DEPLOYMENT_NAME", "")
+        # Smaller, cheaper deployment for title generation; falls back to the main deployment
+        self.AZURE_OPENAI_TITLE_DEPLOYMENT_NAME: str = env.get("AZURE_OPENAI_TITLE_DEPLOYMENT_NAME", "") or self.AZURE_OPENAI_DEPLOYMENT_NAME
+        self.AZURE_OPENAI_API_VERSION: str = env.get("AZURE_OPENAI_API_VERSION", "2024-10-15-preview")
+        self.AZURE_OPENAI_RPM_LIMIT: int = int(env.get("AZURE_OPENAI_RPM_LIMIT", "60"))  # Requests per minute
 
         # Logging
-        self.LOGLEVEL: str = os.getenv("LOGLEVEL", "INFO").upper()  # Default to INFO if not set
+        self.LOGLEVEL: str = env.get("LOGLEVEL", "INFO").upper()  # Default to INFO if not set
+
+    @staticmethod
+    def reset_cache() -> None:
+        """
+        Discards the cached environment so the next instance re-reads .env and os.environ.
+        """
+        _load_env.cache_clear()
 
     def validate(self) -> None:
         """
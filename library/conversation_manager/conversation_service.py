@@ -5,12 +5,21 @@ Provides high-level conversation management for multi-user scenarios,
 combining CosmosDBConversationClient with OpenAIService for optional title generation.
 """
 
+import asyncio
 import logging
-import uuid
-from typing import List, Optional, Any, Dict, Coroutine
-from .cosmos_db_service import CosmosDBConversationClient
+import secrets
+from typing import List, Optional, Any, AsyncIterator, Dict, Coroutine, Sequence, Tuple
+from .cosmos_db_service import MAX_BATCH_OPERATIONS, CosmosDBConversationClient
 from .azure_openai_service import AzureOpenAIService
 
+
+def _new_id() -> str:
+    """
+    Returns a random 128-bit document ID as 32 hex characters.
+    """
+    return secrets.token_hex(16)
+
+
 class ConversationManager:
     """
     High-level conversation manager that handles creation, retrieval, and naming
@@ -50,15 +59,10 @@ class ConversationManager:
             self.logger.debug("Exception details:", exc_info=True)
             raise
 
-    async def create_conversation(self, user_id: str, user_messages: Optional[List[str]] = None) -> Dict[str, Any]:
+    async def _generate_title(self, user_messages: Optional[List[str]]) -> str:
         """
-        Creates a new conversation doc. Optionally generates a conversation title using Azure OpenAI.
+        Generates a conversation title using Azure OpenAI, defaulting to 'Chat'.
         """
-        self.logger.info("Creating a new conversation for user=%s", user_id)
-        conv_id = str(uuid.uuid4())
-        self.logger.debug("Generated conversation ID: %s", conv_id)
-
-        # Attempt to generate a dynamic title
         title = "Chat"
         if self.azure_openai_service and user_messages:
             self.logger.info("Generating conversation title using Azure OpenAI...")
@@ -68,6 +72,18 @@ class ConversationManager:
             except Exception as e:
                 self.logger.error("Title generation failed, defaulting to 'Chat': %s", e)
                 self.logger.debug("Exception details:", exc_info=True)
+        return title
+
+    async def create_conversation(self, user_id: str, user_messages: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        Creates a new conversation doc. Optionally generates a conversation title using Azure OpenAI.
+        """
+        self.logger.info("Creating a new conversation for user=%s", user_id)
+        conv_id = _new_id()
+        self.logger.debug("Generated conversation ID: %s", conv_id)
+
+        # Attempt to generate a dynamic title
+        title = await self._generate_title(user_messages)
 
         try:
             conversation_doc = await self.cosmos_client.create_conversation(
@@ -82,6 +98,40 @@ class ConversationManager:
             self.logger.debug("Exception details:", exc_info=True)
             raise
 
+    async def create_conversation_with_messages(self, user_id: str, messages: List[Dict[str, str]]) -> Dict[str, Any]:
+        """
+        Creates a new conversation doc together with its initial messages in a single Cosmos DB batch.
+        Each message is a dict with 'role' and 'content'. The title is generated from the user-role messages.
+        Returns the conversation doc with the stored messages under 'messages'.
+        Raises ValueError if the conversation and messages do not fit in one batch.
+        """
+        self.logger.info("Creating a new conversation with %d messages for user=%s", len(messages), user_id)
+        # Reject oversized batches before spending a title completion on them
+        if len(messages) + 1 > MAX_BATCH_OPERATIONS:
+            raise ValueError(f"A conversation can be created with at most {MAX_BATCH_OPERATIONS - 1} messages.")
+        conv_id = _new_id()
+        self.logger.debug("Generated conversation ID: %s", conv_id)
+
+        # Attempt to generate a dynamic title
+        title = await self._generate_title([msg["content"] for msg in messages if msg.get("role", "user") == "user"])
+
+        try:
+            conversation_doc, message_docs = await self.cosmos_client.create_conversation_with_messages(
+                conversation_id=conv_id,
+                user_id=user_id,
+                title=title,
+                messages=[
+                    {"id": _new_id(), "role": msg.get("role", "user"), "content": msg.get("content", "")}
+                    for msg in messages
+                ],
+            )
+            self.logger.info("Conversation created successfully with ID=%s", conv_id)
+            return {**conversation_doc, "messages": message_docs}
+        except Exception as e:
+            self.logger.error("Failed to create conversation for user=%s: %s", user_id, e)
+            self.logger.debug("Exception details:", exc_info=True)
+            raise
+
     async def rename_conversation(self, conversation_id: str, user_id: str, new_title: str) -> Dict[str, Any]:
         """
         Allows the user to rename an existing conversation.
@@ -89,12 +139,10 @@ class ConversationManager:
         self.logger.info("Renaming conversation ID=%s for user=%s", conversation_id, user_id)
         self.logger.debug("New title: %s", new_title)
         try:
-            conversation = await self.cosmos_client.get_conversation(conversation_id, user_id)
-            if not conversation:
+            updated = await self.cosmos_client.patch_conversation_title(conversation_id, user_id, new_title)
+            if not updated:
                 self.logger.warning("No conversation found for ID=%s and user=%s", conversation_id, user_id)
                 raise ValueError(f"No conversation found for ID={conversation_id} and user={user_id}")
-            conversation["title"] = new_title
-            updated = await self.cosmos_client.upsert_conversation(conversation)
             self.logger.info("Conversation ID=%s renamed successfully.", conversation_id)
             return updated
         except Exception as e:
@@ -119,29 +167,54 @@ class ConversationManager:
             self.logger.debug("Exception details:", exc_info=True)
             raise
 
-    async def list_conversations(self, user_id: str, limit: int = 25, offset: int = 0) -> List[Dict[str, Any]]:
+    async def list_conversations(
+        self,
+        user_id: str,
+        limit: int = 25,
+        continuation_token: Optional[str] = None,
+        fields: Optional[Sequence[str]] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
         """
-        Returns a list of conversation docs for the user.
+        Returns a page of conversation docs for the user and the continuation token for the next page.
+        Pass `fields` to return only those fields (e.g. ["id", "title"] for a sidebar).
         """
-        self.logger.info("Listing conversations for user=%s with limit=%d and offset=%d", user_id, limit, offset)
+        self.logger.info("Listing conversations for user=%s with limit=%d", user_id, limit)
         try:
-            conversations = await self.cosmos_client.get_conversations(user_id, limit=limit, offset=offset)
+            conversations, next_token = await self.cosmos_client.get_conversations(
+                user_id, limit=limit, continuation_token=continuation_token, fields=fields
+            )
             self.logger.info("Retrieved %d conversations for user=%s", len(conversations), user_id)
-            self.logger.debug("Conversations: %s", conversations)
-            return conversations
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("Conversations: %s", conversations)
+            return conversations, next_token
         except Exception as e:
             self.logger.error("Failed to list conversations for user=%s: %s", user_id, e)
             self.logger.debug("Exception details:", exc_info=True)
             raise
 
+    async def count_conversations(self, user_id: str) -> int:
+        """
+        Returns the total number of conversations for the user.
+        """
+        self.logger.info("Counting conversations for user=%s", user_id)
+        try:
+            return await self.cosmos_client.count_conversations(user_id)
+        except Exception as e:
+            self.logger.error("Failed to count conversations for user=%s: %s", user_id, e)
+            self.logger.debug("Exception details:", exc_info=True)
+            raise
+
     async def delete_conversation(self, conversation_id: str, user_id: str) -> bool:
         """
         Deletes the conversation and all of its messages for the user.
         """
         self.logger.info("Deleting conversation ID=%s for user=%s", conversation_id, user_id)
         try:
-            await self.cosmos_client.delete_messages(conversation_id, user_id)
-            await self.cosmos_client.delete_conversation(conversation_id, user_id)
+            # Messages and the conversation are independent documents, so delete them concurrently
+            await asyncio.gather(
+                self.cosmos_client.delete_messages(conversation_id, user_id),
+                self.cosmos_client.delete_conversation(conversation_id, user_id),
+            )
             self.logger.info("Conversation ID=%s deleted successfully for user=%s", conversation_id, user_id)
             return True
         except Exception as e:
@@ -149,20 +222,24 @@ class ConversationManager:
             self.logger.debug("Exception details:", exc_info=True)
             raise
 
-    async def add_message(self, conversation_id: str, user_id: str, role: str, content: str) -> Dict[str, Any]:
+    async def add_message(
+        self, conversation_id: str, user_id: str, role: str, content: str, created_at: Optional[int] = None
+    ) -> Dict[str, Any]:
         """
         Adds a message to an existing conversation doc.
+        Messages are ordered by `created_at` (nanoseconds since the epoch, defaulting to now); pass
+        increasing values to keep concurrently written messages in a fixed order.
         """
         self.logger.info("Adding message to conversation ID=%s for user=%s", conversation_id, user_id)
         self.logger.debug("Message role: %s, content: %s", role, content)
         try:
-            existing_conv = await self.cosmos_client.get_conversation(conversation_id, user_id)
-            if not existing_conv:
+            message_id = _new_id()
+            message = await self.cosmos_client.create_message(
+                conversation_id, user_id, message_id, role, content, created_at=created_at
+            )
+            if not message:
                 self.logger.warning("Conversation ID=%s not found for user=%s", conversation_id, user_id)
                 raise ValueError(f"Conversation {conversation_id} not found or belongs to different user.")
-
-            message_id = str(uuid.uuid4())
-            message = await self.cosmos_client.create_message(conversation_id, user_id, message_id, role, content)
             self.logger.info("Message added successfully to conversation ID=%s", conversation_id)
             return message
         except Exception as e:
@@ -178,9 +255,44 @@ class ConversationManager:
         try:
             messages = await self.cosmos_client.get_messages(conversation_id, user_id, limit=limit)
             self.logger.info("Retrieved %d messages for conversation ID=%s", len(messages), conversation_id)
-            self.logger.debug("Messages: %s", messages)
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("Messages: %s", messages)
             return messages
         except Exception as e:
             self.logger.error("Failed to retrieve messages for conversation ID=%s for user=%s: %s", conversation_id, user_id, e)
             self.logger.debug("Exception details:", exc_info=True)
             raise
+
+    async def iter_messages(
+        self, conversation_id: str, user_id: str, limit: Optional[int] = 100
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streams up to `limit` messages for a specific conversation, in ascending time order, as they are read
+        from Cosmos DB. The default stops after the oldest 100; pass limit=None to stream the whole conversation.
+        """
+        self.logger.info("Streaming messages for conversation ID=%s for user=%s with limit=%s", conversation_id, user_id, limit)
+        try:
+            async for message in self.cosmos_client.iter_messages(conversation_id, user_id, limit=limit):
+                yield message
+        except Exception as e:
+            self.logger.error("Failed to stream messages for conversation ID=%s for user=%s: %s", conversation_id, user_id, e)
+            self.logger.debug("Exception details:", exc_info=True)
+            raise
+
+    async def get_messages_page(
+        self, conversation_id: str, user_id: str, limit: int = 100, continuation_token: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Returns one page of messages in ascending time order and the continuation token for the next page.
+        """
+        self.logger.info("Retrieving a page of messages for conversation ID=%s for user=%s with limit=%d", conversation_id, user_id, limit)
+        try:
+            messages, next_token = await self.cosmos_client.get_messages_page(
+                conversation_id, user_id, limit=limit, continuation_token=continuation_token
+            )
+            self.logger.info("Retrieved %d messages for conversation ID=%s", len(messages), conversation_id)
+            return messages, next_token
+        except Exception as e:
+            self.logger.error("Failed to retrieve messages for conversation ID=%s for user=%s: %s", conversation_id, user_id, e)
+            self.logger.debug("Exception details:", exc_info=True)
+            raise
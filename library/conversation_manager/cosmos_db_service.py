@@ -5,18 +5,33 @@ Manages conversation history in Cosmos DB, following the reference patterns.
 """
 
 import logging
+import time
+import aiohttp
+from cachetools import TTLCache
+from azure.core.pipeline.transport import AioHttpTransport
 from azure.cosmos.aio import CosmosClient
 from azure.cosmos import PartitionKey
-from azure.cosmos.exceptions import CosmosHttpResponseError, CosmosResourceNotFoundError
+from azure.cosmos.exceptions import CosmosBatchOperationError, CosmosHttpResponseError, CosmosResourceNotFoundError
 from .config import ConversationConfig
-from typing import Optional, List, Dict, Any
+from .retry import retry_on_throttle
+from typing import Optional, List, Dict, Any, AsyncIterator, Sequence, Tuple
 
-# Configure logging for your application
-logging.basicConfig(level=logging.INFO)  # Set the default logging level for your app
+# Cosmos DB caps a transactional batch at 100 operations
+MAX_BATCH_OPERATIONS = 100
 
-# Suppress Azure SDK logs by setting their log level to WARNING or ERROR
-logging.getLogger("azure.core").setLevel(logging.WARNING)
-logging.getLogger("azure.cosmos").setLevel(logging.WARNING)
+# Connection pool and timeout settings for the Cosmos DB HTTP transport (pool size comes from config)
+KEEPALIVE_TIMEOUT_SECONDS = 120
+CONNECTION_TIMEOUT_SECONDS = 5
+READ_TIMEOUT_SECONDS = 30
+CONNECTION_DATA_BLOCK_SIZE = 65536
+
+# Conversation fields that listings may project, and the projection used when none is requested
+CONVERSATION_FIELDS = frozenset({"id", "entra_oid", "title", "_ts"})
+DEFAULT_CONVERSATION_FIELDS = ("id", "entra_oid", "title")
+
+# In-process cache of conversation documents keyed by (conversation_id, user_id)
+CONVERSATION_CACHE_SIZE = 10_000
+CONVERSATION_CACHE_TTL_SECONDS = 30
 
 class CosmosDBConversationClient:
     """
@@ -34,11 +49,20 @@ class CosmosDBConversationClient:
         self.credential = config.COSMOS_DB_KEY
         self.database_name = config.CHAT_HISTORY_DATABASE
         self.container_name = config.CHAT_HISTORY_CONTAINER
+        self.max_connections = config.COSMOS_DB_MAX_CONNECTIONS
 
         # Initialize Cosmos DB client and container
         self._client = None
         self._container = None
 
+        # Short-lived cache so repeated point reads within a session skip Cosmos DB
+        self._conv_cache: TTLCache = TTLCache(maxsize=CONVERSATION_CACHE_SIZE, ttl=CONVERSATION_CACHE_TTL_SECONDS)
+
+        # [write generation, reader count] for conversations with a point read in flight; a write bumps the
+        # generation so a read that started before it does not cache what it fetched. Entries are removed
+        # when their last reader finishes, so this only ever holds keys currently being read
+        self._conv_reads: Dict[Tuple[str, str], List[int]] = {}
+
         # Configure logging for this class based on config
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(config.LOGLEVEL) 
@@ -51,26 +75,50 @@ class CosmosDBConversationClient:
     async def connect(self) -> None:
         """
         Initializes CosmosClient and ensures the database and container exist.
-        This must be called before any CRUD operations.
+        This must be called before any CRUD operations. Calling it again while connected does nothing,
+        so the existing client and its connection pool are never replaced and leaked.
         """
+        if self._client is not None:
+            self.logger.debug("Already connected to Cosmos DB")
+            return
         self.logger.info("Connecting to Cosmos DB...")
         try:
-            self._client = CosmosClient(self.endpoint, credential=self.credential)
+            # Keep a bounded pool of warm connections so bursts reuse them instead of reconnecting
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=KEEPALIVE_TIMEOUT_SECONDS)
+            )
+            transport = AioHttpTransport(
+                session=session,
+                session_owner=True,
+                connection_timeout=CONNECTION_TIMEOUT_SECONDS,
+                read_timeout=READ_TIMEOUT_SECONDS,
+                connection_data_block_size=CONNECTION_DATA_BLOCK_SIZE,
+            )
+            self._client = CosmosClient(
+                self.endpoint,
+                credential=self.credential,
+                consistency_level="Session",
+                transport=transport,
+            )
             await self.ensure_database_and_container()
             self.logger.info("Connected to Cosmos DB container: %s", self.container_name)
         except Exception as e:
             self.logger.error("Failed to connect to Cosmos DB: %s", e)
             self.logger.debug("Exception details:", exc_info=True)
+            await self.close()
             raise
 
     async def close(self) -> None:
         """
-        Closes the underlying CosmosClient session.
+        Closes the underlying CosmosClient session; connect() can be called again afterwards.
         """
         if self._client:
             await self._client.close()
+            self._client = None
+            self._container = None
             self.logger.info("CosmosDB client closed successfully.")
 
+    @retry_on_throttle
     async def ensure_database_and_container(self) -> None:
         """
         Ensures the Cosmos DB database and container exist. Creates them if they do not.
@@ -92,6 +140,7 @@ class CosmosDBConversationClient:
             self.logger.debug("Exception details:", exc_info=True)
             raise
 
+    @retry_on_throttle
     async def create_conversation(self, conversation_id: str, user_id: str, title: str = "") -> Dict[str, Any]:
         """
         Creates a new conversation record in Cosmos DB.
@@ -105,19 +154,68 @@ class CosmosDBConversationClient:
                 "title": title or "Untitled Conversation",
             }
             resp = await self._container.upsert_item(conversation_doc)
+            self._invalidate_conversation(conversation_id, user_id)
             return resp
         except Exception as e:
             self.logger.error("Failed to create conversation ID=%s for user=%s", conversation_id, user_id)
             self.logger.debug("Exception details:", exc_info=True)
             raise
 
+    @retry_on_throttle
+    async def create_conversation_with_messages(
+        self, conversation_id: str, user_id: str, title: str, messages: List[Dict[str, str]]
+    ) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """
+        Creates a conversation record and its initial messages in one transactional batch.
+        Each message must provide 'id', 'role' and 'content'. Raises ValueError if the
+        conversation and messages exceed MAX_BATCH_OPERATIONS.
+        """
+        self.logger.info("Creating conversation ID=%s with %d messages for user=%s", conversation_id, len(messages), user_id)
+        if len(messages) + 1 > MAX_BATCH_OPERATIONS:
+            raise ValueError(f"A conversation can be created with at most {MAX_BATCH_OPERATIONS - 1} messages.")
+        try:
+            conversation_doc = {
+                "id": conversation_id,
+                "entra_oid": user_id,
+                "title": title or "Untitled Conversation",
+            }
+            created_at = time.time_ns()
+            batch = [("upsert", (conversation_doc,))]
+            batch.extend(
+                # Messages in one batch share a _ts, so give each a distinct, increasing createdAt
+                ("upsert", (self._message_doc(
+                    conversation_id, user_id, msg["id"], msg["role"], msg["content"], created_at=created_at + index
+                ),))
+                for index, msg in enumerate(messages)
+            )
+            results = await self._container.execute_item_batch(batch_operations=batch, partition_key=user_id)
+            self._invalidate_conversation(conversation_id, user_id)
+            return results[0]["resourceBody"], [result["resourceBody"] for result in results[1:]]
+        except Exception as e:
+            self.logger.error("Failed to create conversation ID=%s for user=%s", conversation_id, user_id)
+            self.logger.debug("Exception details:", exc_info=True)
+            raise
+
+    @retry_on_throttle
     async def get_conversation(self, conversation_id: str, user_id: str) -> Optional[Dict[str, Any]]:
         """
         Retrieves conversation from Cosmos DB if it belongs to the user.
         """
         self.logger.debug("Fetching conversation id=%s for user=%s", conversation_id, user_id)
+        key = (conversation_id, user_id)
+        # Hand out copies so callers that mutate the result cannot corrupt the cached document
+        cached = self._conv_cache.get(key)
+        if cached is not None:
+            return dict(cached)
+        reads = self._conv_reads.setdefault(key, [0, 0])
+        reads[1] += 1
+        generation = reads[0]
         try:
-            return await self._container.read_item(item=conversation_id, partition_key=user_id)
+            conversation = await self._container.read_item(item=conversation_id, partition_key=user_id)
+            # Only cache the document if no write to it started or finished while it was being read
+            if reads[0] == generation:
+                self._conv_cache[key] = conversation
+            return dict(conversation)
         except CosmosResourceNotFoundError:
             self.logger.info("Conversation ID=%s not found for user=%s", conversation_id, user_id)
             return None
@@ -125,18 +223,67 @@ class CosmosDBConversationClient:
             self.logger.error("Failed to fetch conversation ID=%s for user=%s", conversation_id, user_id)
             self.logger.debug("Exception details:", exc_info=True)
             raise
+        finally:
+            reads[1] -= 1
+            if reads[1] == 0:
+                del self._conv_reads[key]
+
+    def _invalidate_conversation(self, conversation_id: str, user_id: str) -> None:
+        """
+        Drops the cached conversation and marks any point read of it still in flight as stale.
+        Writes call this both before and after the Cosmos DB request.
+        """
+        key = (conversation_id, user_id)
+        self._conv_cache.pop(key, None)
+        reads = self._conv_reads.get(key)
+        if reads is not None:
+            reads[0] += 1
 
+    @retry_on_throttle
     async def upsert_conversation(self, conversation_item: Dict[str, Any]) -> Dict[str, Any]:
         """
         Updates or inserts conversation item. Must include correct 'id' and 'entra_oid' partition key.
         """
-        return await self._container.upsert_item(conversation_item)
+        conversation_id, user_id = conversation_item["id"], conversation_item["entra_oid"]
+        self._invalidate_conversation(conversation_id, user_id)
+        try:
+            return await self._container.upsert_item(conversation_item)
+        finally:
+            # Invalidate again: the write's outcome is only known now, and reads that overlapped it must not be cached
+            self._invalidate_conversation(conversation_id, user_id)
+
+    @retry_on_throttle
+    async def patch_conversation_title(self, conversation_id: str, user_id: str, new_title: str) -> Optional[Dict[str, Any]]:
+        """
+        Updates only the conversation title with a partial document update.
+        Returns None if the conversation does not exist for the user.
+        """
+        self.logger.info("Patching title of conversation id=%s for user=%s", conversation_id, user_id)
+        self._invalidate_conversation(conversation_id, user_id)
+        try:
+            return await self._container.patch_item(
+                item=conversation_id,
+                partition_key=user_id,
+                patch_operations=[{"op": "set", "path": "/title", "value": new_title}],
+            )
+        except CosmosResourceNotFoundError:
+            self.logger.info("Conversation ID=%s not found for user=%s", conversation_id, user_id)
+            return None
+        except Exception as e:
+            self.logger.error("Failed to patch title of conversation ID=%s for user=%s", conversation_id, user_id)
+            self.logger.debug("Exception details:", exc_info=True)
+            raise
+        finally:
+            # Invalidate again: the write's outcome is only known now, and reads that overlapped it must not be cached
+            self._invalidate_conversation(conversation_id, user_id)
 
+    @retry_on_throttle
     async def delete_conversation(self, conversation_id: str, user_id: str) -> bool:
         """
         Deletes conversation for the user.
         """
         self.logger.info("Deleting conversation id=%s for user=%s", conversation_id, user_id)
+        self._invalidate_conversation(conversation_id, user_id)
         try:
             await self._container.delete_item(item=conversation_id, partition_key=user_id)
             self.logger.info("Successfully deleted conversation id=%s for user=%s", conversation_id, user_id)
@@ -145,90 +292,271 @@ class CosmosDBConversationClient:
             self.logger.error("Failed to delete conversation ID=%s for user=%s", conversation_id, user_id)
             self.logger.debug("Exception details:", exc_info=True)
             raise
+        finally:
+            # Invalidate again: the delete's outcome is only known now, and reads that overlapped it must not be cached
+            self._invalidate_conversation(conversation_id, user_id)
 
-    async def get_conversations(self, user_id: str, limit: int = 25, offset: int = 0) -> List[Dict[str, Any]]:
+    @staticmethod
+    def _conversation_projection(fields: Optional[Sequence[str]]) -> str:
         """
-        Queries user conversations, sorted by timestamp.
+        Builds the SELECT list for the requested conversation fields.
+        Raises ValueError for fields outside CONVERSATION_FIELDS, so only allowlisted names reach the query.
         """
-        self.logger.info("Querying conversations for user=%s with limit=%d and offset=%d", user_id, limit, offset)
-        query_str = """
-        SELECT c.id, c.entra_oid, c.title
+        fields = fields or DEFAULT_CONVERSATION_FIELDS
+        invalid = set(fields) - CONVERSATION_FIELDS
+        if invalid:
+            raise ValueError(f"Unsupported conversation fields: {', '.join(sorted(invalid))}")
+        return ", ".join(f"c.{field}" for field in dict.fromkeys(fields))
+
+    def _query_conversations(self, user_id: str, limit: int, fields: Optional[Sequence[str]] = None):
+        """
+        Builds the paged query for a user's conversations, newest first, with at most `limit` items per page.
+        Only the requested fields are projected (DEFAULT_CONVERSATION_FIELDS if none).
+        """
+        query_str = f"""
+        SELECT {self._conversation_projection(fields)}
         FROM c
         WHERE c.entra_oid = @userId
+          AND NOT IS_DEFINED(c.type)
         ORDER BY c._ts DESC
-        OFFSET @offset LIMIT @limit
         """
         params = [
             {"name": "@userId", "value": user_id},
-            {"name": "@offset", "value": offset},
-            {"name": "@limit", "value": limit},
         ]
+        return self._container.query_items(
+            query_str, parameters=params, partition_key=user_id, max_item_count=limit
+        )
 
-        results = []
+    async def iter_conversations(
+        self, user_id: str, limit: int = 25, fields: Optional[Sequence[str]] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streams up to `limit` user conversations, sorted by timestamp, as query result pages arrive.
+        """
+        self.logger.info("Querying conversations for user=%s with limit=%d", user_id, limit)
+        if limit <= 0:
+            return
+        count = 0
         try:
-            async for item in self._container.query_items(query_str, parameters=params):
-                results.append(item)
+            async for item in self._query_conversations(user_id, limit, fields):
+                yield item
+                count += 1
+                if count >= limit:
+                    return
+        except Exception as e:
+            self.logger.error("Failed to query conversations for user=%s", user_id)
+            self.logger.debug("Exception details:", exc_info=True)
+            raise
+
+    @retry_on_throttle
+    async def get_conversations(
+        self,
+        user_id: str,
+        limit: int = 25,
+        continuation_token: Optional[str] = None,
+        fields: Optional[Sequence[str]] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Queries one page of user conversations, sorted by timestamp, projecting only `fields`.
+        Returns the page and the continuation token for the next one (None when there are no more).
+        Raises ValueError if Cosmos DB rejects the continuation token, e.g. a malformed token or one
+        issued for a different user or set of fields.
+        """
+        self.logger.info("Querying conversations for user=%s with limit=%d", user_id, limit)
+        try:
+            pager = self._query_conversations(user_id, limit, fields).by_page(continuation_token)
+            results: List[Dict[str, Any]] = []
+            async for page in pager:
+                results = [item async for item in page]
+                break
             self.logger.debug("Retrieved %d conversations for user=%s", len(results), user_id)
-            return results
+            return results, pager.continuation_token
+        except CosmosHttpResponseError as e:
+            if e.status_code == 400 and continuation_token is not None:
+                self.logger.warning("Rejected continuation token for user=%s", user_id)
+                raise ValueError("Invalid continuation token") from e
+            self.logger.error("Failed to query conversations for user=%s", user_id)
+            self.logger.debug("Exception details:", exc_info=True)
+            raise
         except Exception as e:
             self.logger.error("Failed to query conversations for user=%s", user_id)
             self.logger.debug("Exception details:", exc_info=True)
             raise
 
-    async def create_message(
-        self, conversation_id: str, user_id: str, message_id: str, role: str, content: str
+    @retry_on_throttle
+    async def count_conversations(self, user_id: str) -> int:
+        """
+        Counts the user's conversations (message documents are excluded).
+        """
+        self.logger.info("Counting conversations for user=%s", user_id)
+        query_str = """
+        SELECT VALUE COUNT(1)
+        FROM c
+        WHERE c.entra_oid = @userId
+          AND NOT IS_DEFINED(c.type)
+        """
+        params = [
+            {"name": "@userId", "value": user_id},
+        ]
+        try:
+            async for count in self._container.query_items(query_str, parameters=params, partition_key=user_id):
+                return count
+            return 0
+        except Exception as e:
+            self.logger.error("Failed to count conversations for user=%s", user_id)
+            self.logger.debug("Exception details:", exc_info=True)
+            raise
+
+    @staticmethod
+    def _message_doc(
+        conversation_id: str, user_id: str, message_id: str, role: str, content: str, created_at: Optional[int] = None
     ) -> Dict[str, Any]:
+        """
+        Builds the Cosmos DB document for a single message.
+        'createdAt' is a nanosecond epoch timestamp used to order messages; Cosmos DB's _ts only has
+        one-second resolution, so messages written close together would otherwise have no defined order.
+        """
+        return {
+            "id": message_id,
+            "type": "message",
+            "entra_oid": user_id,
+            "conversationId": conversation_id,
+            "role": role,
+            "content": content,
+            "createdAt": created_at if created_at is not None else time.time_ns(),
+        }
+
+    @retry_on_throttle
+    async def create_message(
+        self,
+        conversation_id: str,
+        user_id: str,
+        message_id: str,
+        role: str,
+        content: str,
+        created_at: Optional[int] = None,
+    ) -> Optional[Dict[str, Any]]:
         """
         Persists a single message within a conversation.
+        The conversation read and the message write run as one transactional batch, so the
+        message is only stored if the conversation exists for the user. Returns None otherwise.
+        `created_at` (nanoseconds since the epoch) sets the message's position; it defaults to now.
         """
         self.logger.info("Creating message for conversation %s, role=%s", conversation_id, role)
         self.logger.debug("Message content: %s", content)
         try:
-            message_doc = {
-                "id": message_id,
-                "type": "message",
-                "entra_oid": user_id,
-                "conversationId": conversation_id,
-                "role": role,
-                "content": content,
-            }
-            return await self._container.upsert_item(message_doc)
+            message_doc = self._message_doc(conversation_id, user_id, message_id, role, content, created_at=created_at)
+            batch = [
+                ("read", (conversation_id,)),
+                ("upsert", (message_doc,)),
+            ]
+            results = await self._container.execute_item_batch(batch_operations=batch, partition_key=user_id)
+            return results[1]["resourceBody"]
+        except CosmosBatchOperationError as e:
+            if e.status_code == 404 and e.error_index == 0:
+                self.logger.info("Conversation ID=%s not found for user=%s", conversation_id, user_id)
+                return None
+            self.logger.error("Failed to create message for conversation ID=%s", conversation_id)
+            self.logger.debug("Exception details:", exc_info=True)
+            raise
         except Exception as e:
             self.logger.error("Failed to create message for conversation ID=%s", conversation_id)
             self.logger.debug("Exception details:", exc_info=True)
             raise
 
-    async def get_messages(self, conversation_id: str, user_id: str, limit: int = 100) -> List[Dict[str, Any]]:
+    def _query_messages(self, conversation_id: str, user_id: str, limit: Optional[int]):
         """
-        Retrieve messages associated with the conversation, sorted by creation order.
+        Builds the paged query for a conversation's messages, sorted by creation order.
+        Only the fields callers use are projected, and pages hold at most `limit` items
+        (the service's default page size when `limit` is None).
         """
         query_str = """
-        SELECT *
+        SELECT c.id, c.role, c.content, c._ts, c.createdAt
         FROM c
         WHERE c.entra_oid = @userId
           AND c.conversationId = @convId
           AND c.type = 'message'
-        ORDER BY c._ts ASC
+        ORDER BY c.createdAt ASC
         """
         params = [
             {"name": "@userId", "value": user_id},
             {"name": "@convId", "value": conversation_id},
         ]
-        results = []
-        async for item in self._container.query_items(query_str, parameters=params):
-            results.append(item)
-        return results
+        return self._container.query_items(
+            query_str, parameters=params, partition_key=user_id, max_item_count=limit
+        )
+
+    async def iter_messages(
+        self, conversation_id: str, user_id: str, limit: Optional[int] = 100
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streams up to `limit` messages associated with the conversation, sorted by creation order,
+        as query result pages arrive. Pass limit=None to stream every message.
+        """
+        if limit is not None and limit <= 0:
+            return
+        count = 0
+        async for item in self._query_messages(conversation_id, user_id, limit):
+            yield item
+            count += 1
+            if limit is not None and count >= limit:
+                return
 
+    @retry_on_throttle
+    async def get_messages(self, conversation_id: str, user_id: str, limit: int = 100) -> List[Dict[str, Any]]:
+        """
+        Retrieve up to `limit` messages associated with the conversation, sorted by creation order.
+        """
+        return [item async for item in self.iter_messages(conversation_id, user_id, limit=limit)]
+
+    @retry_on_throttle
+    async def get_messages_page(
+        self, conversation_id: str, user_id: str, limit: int = 100, continuation_token: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Retrieve one page of messages, sorted by creation order.
+        Returns the page and the continuation token for the next one (None when there are no more).
+        """
+        self.logger.info("Querying a page of messages for conversation ID=%s with limit=%d", conversation_id, limit)
+        try:
+            pager = self._query_messages(conversation_id, user_id, limit).by_page(continuation_token)
+            items: List[Dict[str, Any]] = []
+            async for page in pager:
+                items = [item async for item in page]
+                break
+            return items, pager.continuation_token
+        except Exception as e:
+            self.logger.error("Failed to query messages for conversation ID=%s", conversation_id)
+            self.logger.debug("Exception details:", exc_info=True)
+            raise
+
+    @retry_on_throttle
     async def delete_messages(self, conversation_id: str, user_id: str) -> bool:
         """
         Removes all messages for a conversation.
+        Messages share the user's partition key, so they are deleted in transactional batches
+        of at most MAX_BATCH_OPERATIONS operations instead of one request per message.
         """
         self.logger.info("Deleting all messages for conversation ID=%s and user=%s", conversation_id, user_id)
+        query_str = """
+        SELECT c.id
+        FROM c
+        WHERE c.entra_oid = @userId
+          AND c.conversationId = @convId
+          AND c.type = 'message'
+        """
+        params = [
+            {"name": "@userId", "value": user_id},
+            {"name": "@convId", "value": conversation_id},
+        ]
         try:
-            messages = await self.get_messages(conversation_id, user_id)
-            for msg in messages:
-                await self._container.delete_item(item=msg["id"], partition_key=msg["entra_oid"])
-            self.logger.info("Successfully deleted all messages for conversation ID=%s and user=%s", conversation_id, user_id)
+            message_ids = [
+                item["id"] async for item in self._container.query_items(query_str, parameters=params, partition_key=user_id)
+            ]
+            for start in range(0, len(message_ids), MAX_BATCH_OPERATIONS):
+                batch = [("delete", (message_id,)) for message_id in message_ids[start:start + MAX_BATCH_OPERATIONS]]
+                await self._container.execute_item_batch(batch_operations=batch, partition_key=user_id)
+            self.logger.info("Successfully deleted %d messages for conversation ID=%s and user=%s", len(message_ids), conversation_id, user_id)
             return True
         except Exception as e:
             self.logger.error("Failed to delete messages for conversation ID=%s and user=%s", conversation_id, user_id)
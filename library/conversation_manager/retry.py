@@ -0,0 +1,48 @@
+"""
+conversation_manager/retry.py
+
+Shared retry policy for transient throttling and availability errors from Cosmos DB and Azure OpenAI.
+"""
+
+from azure.core.exceptions import HttpResponseError
+from openai import APIStatusError
+from tenacity import retry, retry_if_exception, stop_after_attempt, stop_after_delay, wait_random_exponential
+
+# HTTP status codes worth retrying: throttled (429) and service unavailable (503)
+RETRYABLE_STATUS_CODES = frozenset({429, 503})
+
+# The Cosmos DB SDK already retries 429s itself, honouring the service's retry-after hint,
+# so only unavailability is retried on top of it
+COSMOS_RETRYABLE_STATUS_CODES = frozenset({503})
+
+# Title generation sits on the request path, so its retries give up sooner
+TITLE_MAX_ATTEMPTS = 3
+TITLE_MAX_DELAY_SECONDS = 10
+
+
+def _is_retryable(exc: BaseException) -> bool:
+    """
+    Returns True for Cosmos DB or Azure OpenAI errors caused by throttling or temporary unavailability.
+    """
+    if isinstance(exc, APIStatusError):
+        return exc.status_code in RETRYABLE_STATUS_CODES
+    if isinstance(exc, HttpResponseError):
+        return exc.status_code in COSMOS_RETRYABLE_STATUS_CODES
+    return False
+
+
+# Retries the decorated coroutine with randomized exponential backoff, then re-raises the last error
+retry_on_throttle = retry(
+    wait=wait_random_exponential(min=1, max=30),
+    stop=stop_after_attempt(5),
+    retry=retry_if_exception(_is_retryable),
+    reraise=True,
+)
+
+# Same policy for title requests, but bounded by TITLE_MAX_ATTEMPTS and TITLE_MAX_DELAY_SECONDS in total
+retry_title_request = retry(
+    wait=wait_random_exponential(min=1, max=5),
+    stop=stop_after_attempt(TITLE_MAX_ATTEMPTS) | stop_after_delay(TITLE_MAX_DELAY_SECONDS),
+    retry=retry_if_exception(_is_retryable),
+    reraise=True,
+)
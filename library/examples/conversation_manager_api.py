@@ -5,13 +5,23 @@ Example application demonstrating usage of conversation_manager.
 """
 import sys
 import os
-from typing import List, Dict, Any, Optional
-from quart import Quart, request, jsonify, Response
+import gzip
+import zlib
+from typing import AsyncIterator, List, Dict, Any, Optional, Type, TypeVar, Union
+import msgpack
+import msgspec
+import orjson
+from cachetools import TTLCache
+from quart import Quart, request, Response
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional; responses fall back to gzip
+    brotli = None
 
 # Add the parent directory to sys.path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-import asyncio
 import logging
 from conversation_manager import (
     ConversationConfig,
@@ -23,6 +33,93 @@ from conversation_manager import (
 app = Quart(__name__)
 logging.basicConfig(level=logging.INFO)
 
+# Pre-encoded bodies for static error responses
+_ERR_400_INVALID_JSON: bytes = orjson.dumps({"error": "Invalid JSON body"})
+_ERR_404_CONVERSATION: bytes = orjson.dumps({"error": "Conversation not found"})
+_ERR_500: bytes = orjson.dumps({"error": "Internal server error"})
+
+# Binary alternative to JSON for list endpoints, selected through the Accept header
+MSGPACK_MIMETYPE: str = "application/msgpack"
+
+# JSON bodies smaller than this many bytes are sent uncompressed
+COMPRESS_MIN_SIZE: int = 500
+COMPRESS_LEVEL: int = 6
+
+# Per-user conversation totals, reused across pages for a short time
+_conversation_counts: TTLCache = TTLCache(maxsize=10_000, ttl=300)
+
+# (conversation_id, user_id) pairs recently found not to exist, so repeated misses skip Cosmos DB
+_missing_conversations: TTLCache = TTLCache(maxsize=10_000, ttl=60)
+
+def ojsonify(data: Any, status: int = 200) -> Response:
+    """
+    Serializes data with orjson into a JSON response; faster than Quart's stdlib-based jsonify.
+    """
+    return Response(orjson.dumps(data, default=str), status=status, content_type="application/json")
+
+def msgpackify(data: Any, status: int = 200) -> Response:
+    """
+    Serializes data with MessagePack; smaller and faster to decode than JSON for machine clients.
+    """
+    response = Response(msgpack.packb(data, use_bin_type=True, default=str), status=status, content_type=MSGPACK_MIMETYPE)
+    response.vary.add("Accept")
+    return response
+
+def _wants_msgpack() -> bool:
+    """
+    True if the client prefers MessagePack over JSON; JSON stays the default for */* and missing Accept headers.
+    """
+    return request.accept_mimetypes.best_match(["application/json", MSGPACK_MIMETYPE]) == MSGPACK_MIMETYPE
+
+# Request bodies, decoded and validated in C by msgspec
+class NewMessage(msgspec.Struct):
+    role: str = "user"
+    content: str = ""
+
+class CreateConversationBody(msgspec.Struct):
+    user_id: str = ""
+    messages: List[Union[str, NewMessage]] = []
+
+class AddMessageBody(msgspec.Struct):
+    user_id: str = ""
+    role: str = "user"
+    content: str = ""
+
+class RenameConversationBody(msgspec.Struct):
+    user_id: str = ""
+    new_title: str = "Untitled"
+
+BodyT = TypeVar("BodyT", bound=msgspec.Struct)
+
+async def read_body(body_type: Type[BodyT]) -> BodyT:
+    """
+    Decodes and validates the request body into body_type with msgspec.
+    """
+    return msgspec.json.decode(await request.get_data(cache=False), type=body_type)
+
+def _response_encoding() -> Optional[str]:
+    """
+    Picks the best compression the client accepts: Brotli when available, otherwise gzip.
+    """
+    encodings: List[str] = ["br", "gzip"] if brotli else ["gzip"]
+    return request.accept_encodings.best_match(encodings)
+
+async def _compress_stream(chunks: AsyncIterator[bytes], encoding: str) -> AsyncIterator[bytes]:
+    """
+    Compresses a streamed response body chunk by chunk.
+    """
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=COMPRESS_LEVEL)
+        compress, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)  # wbits=31 writes a gzip container
+        compress, finish = compressor.compress, compressor.flush
+    async for chunk in chunks:
+        data = compress(chunk)
+        if data:
+            yield data
+    yield finish()
+
 # Globally initialize managers
 config = ConversationConfig()
 config.validate()
@@ -44,72 +141,195 @@ async def startup() -> None:
 async def shutdown() -> None:
     await manager.close()
 
+@app.after_request
+async def compress_response(response: Response) -> Response:
+    # Streamed bodies have no length here; they are compressed by their route as they are produced
+    encoding: Optional[str] = _response_encoding()
+    if (
+        encoding is None
+        or response.mimetype != "application/json"
+        or response.content_length is None
+        or response.content_length < COMPRESS_MIN_SIZE
+        or "Content-Encoding" in response.headers
+    ):
+        return response
+    data: bytes = await response.get_data()
+    if encoding == "br":
+        response.set_data(brotli.compress(data, quality=COMPRESS_LEVEL))
+    else:
+        response.set_data(gzip.compress(data, compresslevel=COMPRESS_LEVEL))
+    response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    return response
+
+@app.errorhandler(msgspec.DecodeError)
+async def invalid_body(e: msgspec.DecodeError) -> Response:
+    logging.warning("Invalid request body: %s", e)
+    if isinstance(e, msgspec.ValidationError):
+        return Response(orjson.dumps({"error": str(e)}), status=400, content_type="application/json")
+    return Response(_ERR_400_INVALID_JSON, status=400, content_type="application/json")
+
+async def _count_conversations(user_id: str) -> int:
+    """
+    Returns the user's conversation total, counting in Cosmos DB at most once per cache TTL.
+    """
+    total: Optional[int] = _conversation_counts.get(user_id)
+    if total is None:
+        total = await manager.count_conversations(user_id)
+        _conversation_counts[user_id] = total
+    return total
+
 @app.route("/conversations", methods=["POST"])
 async def create_new_conversation() -> Response:
-    data: Dict[str, Any] = await request.get_json()
-    user_id: str = data.get("user_id", "")
-    user_messages: List[Dict[str, Any]] = data.get("messages", [])
-    new_conv: Dict[str, Any] = await manager.create_conversation(user_id, user_messages=user_messages)
-    return jsonify(new_conv), 201
+    body: CreateConversationBody = await read_body(CreateConversationBody)
+    user_id: str = body.user_id
+
+    # Messages given as {"role", "content"} objects are stored with the conversation in one batch;
+    # plain strings are only used as context for the generated title
+    if body.messages and all(isinstance(msg, NewMessage) for msg in body.messages):
+        try:
+            new_conv: Dict[str, Any] = await manager.create_conversation_with_messages(
+                user_id, [{"role": msg.role, "content": msg.content} for msg in body.messages]
+            )
+        except ValueError as e:
+            logging.warning("ValueError: %s", e)
+            return Response(orjson.dumps({"error": str(e)}), status=400, content_type="application/json")
+    else:
+        user_messages: List[str] = [msg if isinstance(msg, str) else msg.content for msg in body.messages]
+        new_conv = await manager.create_conversation(user_id, user_messages=user_messages)
+    _conversation_counts.pop(user_id, None)
+    _missing_conversations.pop((new_conv["id"], user_id), None)
+    return ojsonify(new_conv, 201)
 
 @app.route("/conversations/<conv_id>/messages", methods=["POST"])
 async def add_message(conv_id: str) -> Response:
-    data: Dict[str, Any] = await request.get_json()
-    user_id: str = data.get("user_id", "")
-    role: str = data.get("role", "user")
-    content: str = data.get("content", "")
+    body: AddMessageBody = await read_body(AddMessageBody)
+    user_id: str = body.user_id
+
+    if (conv_id, user_id) in _missing_conversations:
+        return Response(_ERR_404_CONVERSATION, status=404, content_type="application/json")
 
     try:
-        msg: Dict[str, Any] = await manager.add_message(conv_id, user_id, role, content)
-        return jsonify(msg), 200
+        msg: Dict[str, Any] = await manager.add_message(conv_id, user_id, body.role, body.content)
+        return ojsonify(msg, 200)
     except ValueError as e:
         logging.warning("ValueError: %s", e)
-        return jsonify({"error": str(e)}), 404
+        _missing_conversations[(conv_id, user_id)] = True
+        return Response(orjson.dumps({"error": str(e)}), status=404, content_type="application/json")
     except Exception as e:
         logging.error("Unexpected error: %s", e)
-        return jsonify({"error": "Internal server error"}), 500
+        return Response(_ERR_500, status=500, content_type="application/json")
+
+async def _stream_messages(messages: AsyncIterator[Dict[str, Any]], first: Optional[Dict[str, Any]]) -> AsyncIterator[bytes]:
+    """
+    Encodes the conversation's messages as a JSON array one message at a time, starting with
+    the already-fetched first message (None when the conversation has no messages).
+    """
+    if first is None:
+        yield b"[]"
+        return
+    yield b"[" + orjson.dumps(first, default=str)
+    async for message in messages:
+        yield b"," + orjson.dumps(message, default=str)
+    yield b"]"
 
 @app.route("/conversations/<conv_id>/messages", methods=["GET"])
 async def list_messages(conv_id: str) -> Response:
     user_id: str = request.args.get("user_id", "")
-    msgs: List[Dict[str, Any]] = await manager.get_messages(conv_id, user_id)
-    return jsonify(msgs), 200
+    messages: AsyncIterator[Dict[str, Any]] = manager.iter_messages(conv_id, user_id, limit=None)
+    if _wants_msgpack():
+        try:
+            return msgpackify([message async for message in messages], 200)
+        except Exception as e:
+            logging.error("Unexpected error: %s", e)
+            return Response(_ERR_500, status=500, content_type="application/json")
+
+    # Read the first page before committing to a streamed 200 response, so a failed query becomes a 500
+    # instead of a truncated JSON body
+    try:
+        first: Optional[Dict[str, Any]] = await anext(messages, None)
+    except Exception as e:
+        logging.error("Unexpected error: %s", e)
+        return Response(_ERR_500, status=500, content_type="application/json")
+    encoding: Optional[str] = _response_encoding()
+    body: AsyncIterator[bytes] = _stream_messages(messages, first)
+    if encoding:
+        body = _compress_stream(body, encoding)
+    response = Response(body, status=200, content_type="application/json")
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.vary.update(["Accept", "Accept-Encoding"])
+    return response
 
 @app.route("/conversations/<conv_id>", methods=["PUT"])
 async def rename_conversation(conv_id: str) -> Response:
-    data: Dict[str, Any] = await request.get_json()
-    user_id: str = data.get("user_id", "")
-    new_title: str = data.get("new_title", "Untitled")
-    updated: Dict[str, Any] = await manager.rename_conversation(conv_id, user_id, new_title)
-    return jsonify(updated), 200
+    body: RenameConversationBody = await read_body(RenameConversationBody)
+    updated: Dict[str, Any] = await manager.rename_conversation(conv_id, body.user_id, body.new_title)
+    return ojsonify(updated, 200)
 
 @app.route("/conversations/<conv_id>", methods=["DELETE"])
 async def delete_conversation(conv_id: str) -> Response:
     user_id: str = request.args.get("user_id", "")
     await manager.delete_conversation(conv_id, user_id)
-    return jsonify({"status": "deleted"}), 204
+    _conversation_counts.pop(user_id, None)
+    return ojsonify({"status": "deleted"}, 204)
 
 @app.route("/conversations", methods=["GET"])
 async def list_conversations() -> Response:
     user_id: str = request.args.get("user_id", "")
-    limit: int = int(request.args.get("limit", 25))
-    offset: int = int(request.args.get("offset", 0))
-    conversations: List[Dict[str, Any]] = await manager.list_conversations(user_id, limit=limit, offset=offset)
-    return jsonify(conversations), 200
+    limit_arg: str = request.args.get("limit", "25")
+    if not limit_arg.isdecimal() or int(limit_arg) < 1:
+        return Response(orjson.dumps({"error": "limit must be a positive integer"}), status=400, content_type="application/json")
+    limit: int = int(limit_arg)
+    cursor: Optional[str] = request.args.get("cursor") or None
+    fields: List[str] = [field.strip() for field in request.args.get("fields", "").split(",") if field.strip()]
+    try:
+        conversations, next_cursor = await manager.list_conversations(
+            user_id, limit=limit, continuation_token=cursor, fields=fields or None
+        )
+    except ValueError as e:
+        logging.warning("ValueError: %s", e)
+        return Response(orjson.dumps({"error": str(e)}), status=400, content_type="application/json")
+    total: int = await _count_conversations(user_id)
+    page: Dict[str, Any] = {"items": conversations, "next_cursor": next_cursor, "total": total}
+    if _wants_msgpack():
+        return msgpackify(page, 200)
+    response = ojsonify(page, 200)
+    response.vary.add("Accept")
+    return response
 
 @app.route("/conversations/<conv_id>", methods=["GET"])
 async def get_conversation(conv_id: str) -> Response:
     user_id: str = request.args.get("user_id", "")
     conversation: Optional[Dict[str, Any]] = await manager.get_conversation(conversation_id=conv_id, user_id=user_id)
     if not conversation:
-        return jsonify({"error": "Conversation not found"}), 404
-    return jsonify(conversation), 200
+        return Response(_ERR_404_CONVERSATION, status=404, content_type="application/json")
+
+    # Cosmos DB maintains a quoted _etag on every document; skip the body when the client already has it
+    etag: str = conversation.get("_etag", "").strip('"')
+    if etag and request.if_none_match.contains_weak(etag):
+        response = Response(b"", status=304)
+        response.set_etag(etag)
+        return response
+    response = ojsonify(conversation, 200)
+    if etag:
+        response.set_etag(etag)
+    return response
 
 if __name__ == "__main__":
-    # For synchronous servers, wrap in asyncio
-    import hypercorn.asyncio
     from hypercorn.config import Config as HyperConfig
+    from hypercorn.run import run
 
     hyperconfig = HyperConfig()
     hyperconfig.bind = ["0.0.0.0:8000"]
-    asyncio.run(hypercorn.asyncio.serve(app, hyperconfig))
+    hyperconfig.keep_alive_timeout = 75
+
+    # Run on uvloop with a single worker by default. The conversation cache, count cache, missing-conversation
+    # cache and Azure OpenAI rate limiter are all per process: with WEB_CONCURRENCY > 1 a write only invalidates
+    # the worker that handled it, and the effective request rate is workers x AZURE_OPENAI_RPM_LIMIT
+    hyperconfig.worker_class = "uvloop"
+    hyperconfig.workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+
+    # Each worker process imports the app itself, so point Hypercorn at this file
+    hyperconfig.application_path = f"{os.path.abspath(__file__)}:app"
+    run(hyperconfig)
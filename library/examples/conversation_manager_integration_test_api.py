@@ -1,108 +1,146 @@
 import asyncio
+import sys
 import httpx
+import msgpack
 from typing import List, Dict, Any
 
 API_BASE_URL: str = "http://0.0.0.0:8000"  # Base URL of the running API
 
+# Shared HTTP/2 client with a keep-alive pool, reused by every test run in this process.
+# httpx only negotiates HTTP/2 through TLS ALPN, so over plain http:// it would fall back to HTTP/1.1;
+# disabling HTTP/1.1 makes it speak cleartext HTTP/2 (h2c) with prior knowledge, which Hypercorn accepts
+CLIENT: httpx.AsyncClient = httpx.AsyncClient(
+    http1=False,
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=100, max_connections=200, keepalive_expiry=120),
+    timeout=httpx.Timeout(10.0),
+)
+
 async def main() -> None:
-    async with httpx.AsyncClient() as client:
-        # 1. Create a new conversation
-        user_id: str = "00000000-0000-0000-0000-000000000000"
-        user_messages: List[str] = ["Hello, I'd like to discuss sales figures."]
-        response: httpx.Response = await client.post(
-            f"{API_BASE_URL}/conversations",
-            json={"user_id": user_id, "messages": user_messages},
-        )
-        assert response.status_code == 201, f"Failed to create conversation: {response.text}"
-        new_conv: Dict[str, Any] = response.json()
-        print("Created conversation:", new_conv)
-        print("\n\n")
-
-        # Extract conversation ID
-        conversation_id: str = new_conv["id"]
-
-        # 2. Add messages to the conversation
-        response = await client.post(
-            f"{API_BASE_URL}/conversations/{conversation_id}/messages",
-            json={"user_id": user_id, "role": "user", "content": "What are last quarter's numbers?"},
-        )
-        assert response.status_code == 200, f"Failed to add user message: {response.text}"
-        print("Added user message:", response.json())
-        print("\n\n")
-        response = await client.post(
-            f"{API_BASE_URL}/conversations/{conversation_id}/messages",
-            json={"user_id": user_id, "role": "assistant", "content": "Last quarter's numbers rose by 15%. [doc1]"},
-        )
-        assert response.status_code == 200, f"Failed to add assistant message: {response.text}"
-        print("Added assistant message:", response.json())
-        print("\n\n")
+    # 1. Create a new conversation together with its first messages
+    user_id: str = "00000000-0000-0000-0000-000000000000"
+    user_messages: List[Dict[str, str]] = [
+        {"role": "user", "content": "Hello, I'd like to discuss sales figures."},
+        {"role": "user", "content": "What are last quarter's numbers?"},
+        {"role": "assistant", "content": "Last quarter's numbers rose by 15%. [doc1]"},
+    ]
+    response: httpx.Response = await CLIENT.post(
+        f"{API_BASE_URL}/conversations",
+        json={"user_id": user_id, "messages": user_messages},
+    )
+    assert response.status_code == 201, f"Failed to create conversation: {response.text}"
+    new_conv: Dict[str, Any] = response.json()
+    assert len(new_conv["messages"]) == len(user_messages), f"Expected {len(user_messages)} messages: {new_conv}"
+    print("Created conversation:", new_conv)
+    print("\n\n")
+
+    # Extract conversation ID
+    conversation_id: str = new_conv["id"]
+
+    # 2. Messages were added in step 1 as part of the same batch
+
+    # 3, 4 and 6 are independent reads, so issue them together; with the client speaking h2c they are
+    # multiplexed as concurrent streams on one pooled connection instead of opening one connection each
+    info_response, messages_response, list_response = await asyncio.gather(
         # 3. Retrieve conversation info
-        response = await client.get(
+        CLIENT.get(
             f"{API_BASE_URL}/conversations/{conversation_id}",
             params={"user_id": user_id},
-        )
-        assert response.status_code == 200, f"Failed to retrieve conversation info: {response.text}"
-        conv_info: Dict[str, Any] = response.json()
-        print("Conversation info:", conv_info)
-        print("\n\n")
+        ),
         # 4. Retrieve messages
-        response = await client.get(
+        CLIENT.get(
             f"{API_BASE_URL}/conversations/{conversation_id}/messages",
             params={"user_id": user_id},
-        )
-        assert response.status_code == 200, f"Failed to retrieve messages: {response.text}"
-        conv_messages: List[Dict[str, Any]] = response.json()
-        print("Messages:", conv_messages)
-        print("\n\n")
-
-        # 5. Rename the conversation
-        new_title: str = "Sales Discussion"
-        response = await client.put(
-            f"{API_BASE_URL}/conversations/{conversation_id}",
-            json={"user_id": user_id, "new_title": new_title},
-        )
-        assert response.status_code == 200, f"Failed to rename conversation: {response.text}"
-        updated_conv: Dict[str, Any] = response.json()
-        print("Renamed conversation:", updated_conv)
-        print("\n\n")
-
+            headers={"Accept": "application/msgpack"},
+        ),
         # 6. List all conversations for the user
-        response = await client.get(
+        CLIENT.get(
             f"{API_BASE_URL}/conversations",
-            params={"user_id": user_id, "limit": 10, "offset": 0},
-        )
-        assert response.status_code == 200, f"Failed to list conversations: {response.text}"
-        conversations: List[Dict[str, Any]] = response.json()
-        print("List of conversations:", conversations)
-        print("\n\n")
-
-        # 7. Delete the conversation
-        response = await client.delete(
-            f"{API_BASE_URL}/conversations/{conversation_id}",
-            params={"user_id": user_id},
-        )
-        assert response.status_code == 204, f"Failed to delete conversation: {response.text}"
-        print("Deleted conversation successfully.")
-        print("\n\n")
+            params={"user_id": user_id, "limit": 10},
+            headers={"Accept": "application/msgpack"},
+        ),
+    )
 
-        # 8. Edge case - Try to retrieve a deleted conversation
-        response = await client.get(
-            f"{API_BASE_URL}/conversations/{conversation_id}",
-            params={"user_id": user_id},
-        )
-        assert response.status_code == 404, f"Expected 404 for deleted conversation, got: {response.status_code}"
-        print("Deleted conversation retrieval (should be 404):", response.json())
-        print("\n\n")
-
-        # 9. Edge case - Try to add a message to a non-existent conversation
-        print("Trying to add a message to a non-existent conversation...")
-        response = await client.post(
-            f"{API_BASE_URL}/conversations/non-existent-id/messages",
-            json={"user_id": user_id, "role": "user", "content": "This should fail."},
-        )
-        assert response.status_code == 404, f"Expected 404 for non-existent conversation, got: {response.status_code}"
-        print("Expected error when adding message to non-existent conversation:", response.json())
-        print("\n\n")
+    assert info_response.status_code == 200, f"Failed to retrieve conversation info: {info_response.text}"
+    conv_info: Dict[str, Any] = info_response.json()
+    print("Conversation info:", conv_info)
+    print("\n\n")
+
+    assert messages_response.status_code == 200, f"Failed to retrieve messages: {messages_response.text}"
+    assert messages_response.headers["Content-Type"] == "application/msgpack", f"Expected MessagePack: {messages_response.headers}"
+    conv_messages: List[Dict[str, Any]] = msgpack.unpackb(messages_response.content)
+    print("Messages:", conv_messages)
+    print("\n\n")
+
+    # 4b. Retrieve the messages again as streamed, gzip-compressed JSON; httpx decompresses the body
+    response = await CLIENT.get(
+        f"{API_BASE_URL}/conversations/{conversation_id}/messages",
+        params={"user_id": user_id},
+        headers={"Accept-Encoding": "gzip"},
+    )
+    assert response.status_code == 200, f"Failed to retrieve messages as JSON: {response.text}"
+    assert response.headers.get("Content-Encoding") == "gzip", f"Expected a gzip body: {response.headers}"
+    json_messages: List[Dict[str, Any]] = response.json()
+    assert json_messages == conv_messages, f"JSON and MessagePack messages differ: {json_messages}"
+    assert [(msg["role"], msg["content"]) for msg in json_messages] == [
+        (msg["role"], msg["content"]) for msg in user_messages
+    ], f"Messages not returned in order: {json_messages}"
+    print("Messages (JSON):", json_messages)
+    print("\n\n")
+
+    assert list_response.status_code == 200, f"Failed to list conversations: {list_response.text}"
+    conversations: List[Dict[str, Any]] = msgpack.unpackb(list_response.content)["items"]
+    print("List of conversations:", conversations)
+    print("\n\n")
+
+    # 5. Rename the conversation
+    new_title: str = "Sales Discussion"
+    response = await CLIENT.put(
+        f"{API_BASE_URL}/conversations/{conversation_id}",
+        json={"user_id": user_id, "new_title": new_title},
+    )
+    assert response.status_code == 200, f"Failed to rename conversation: {response.text}"
+    updated_conv: Dict[str, Any] = response.json()
+    print("Renamed conversation:", updated_conv)
+    print("\n\n")
+
+    # 7. Delete the conversation
+    response = await CLIENT.delete(
+        f"{API_BASE_URL}/conversations/{conversation_id}",
+        params={"user_id": user_id},
+    )
+    assert response.status_code == 204, f"Failed to delete conversation: {response.text}"
+    print("Deleted conversation successfully.")
+    print("\n\n")
+
+    # 8. Edge case - Try to retrieve a deleted conversation
+    response = await CLIENT.get(
+        f"{API_BASE_URL}/conversations/{conversation_id}",
+        params={"user_id": user_id},
+    )
+    assert response.status_code == 404, f"Expected 404 for deleted conversation, got: {response.status_code}"
+    print("Deleted conversation retrieval (should be 404):", response.json())
+    print("\n\n")
+
+    # 9. Edge case - Try to add a message to a non-existent conversation
+    print("Trying to add a message to a non-existent conversation...")
+    response = await CLIENT.post(
+        f"{API_BASE_URL}/conversations/non-existent-id/messages",
+        json={"user_id": user_id, "role": "user", "content": "This should fail."},
+    )
+    assert response.status_code == 404, f"Expected 404 for non-existent conversation, got: {response.status_code}"
+    print("Expected error when adding message to non-existent conversation:", response.json())
+    print("\n\n")
+
+async def run() -> None:
+    # Buffer test output and write it once at the end instead of one write per print
+    sys.stdout.reconfigure(line_buffering=False, write_through=False)
+    try:
+        await main()
+    finally:
+        # Close the shared client on the same event loop that opened its connections
+        await CLIENT.aclose()
+        sys.stdout.flush()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(run())
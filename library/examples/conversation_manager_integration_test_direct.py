@@ -9,15 +9,19 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 # Imports
 import asyncio
 import logging
+import time
 from conversation_manager import (
     ConversationConfig,
     CosmosDBConversationClient,
     AzureOpenAIService,
     ConversationManager,
 )
-from typing import List, Dict, Optional
+from typing import Any, List, Dict, Optional
 
 async def main() -> None:
+    # Buffer test output and write it once at the end instead of one write per print
+    sys.stdout.reconfigure(line_buffering=False, write_through=False)
+
     # 1. Load config from .env
     config: ConversationConfig = ConversationConfig()
     config.validate()  # Raise ValueError if critical env vars are missing
@@ -36,17 +40,29 @@ async def main() -> None:
     await manager.initialize()
 
     try:
-        # Test 1: Create a new conversation
+        # Test 1: Create a new conversation together with its first messages
         user_id: str = "00000000-0000-0000-0000-000000000000"
-        user_messages: List[str] = ["Hello, I'd like to discuss sales figures."]
-        new_conv: Dict[str, str] = await manager.create_conversation(user_id, user_messages=user_messages)
+        user_messages: List[Dict[str, str]] = [
+            {"role": "user", "content": "Hello, I'd like to discuss sales figures."},
+            {"role": "user", "content": "What are last quarter's numbers?"},
+            {"role": "assistant", "content": "Last quarter's numbers rose by 15%. [doc1]"},
+        ]
+        new_conv: Dict[str, Any] = await manager.create_conversation_with_messages(user_id, user_messages)
         print("Created conversation:", new_conv)
         print("\n\n")
 
-        # Test 2: Add messages to the conversation
+        # Test 2: Add a follow-up exchange to the conversation
+        # The two writes are independent, so issue them concurrently; explicit, increasing created_at
+        # values keep the question ahead of the reply whichever write lands first
         conversation_id: str = new_conv["id"]
-        await manager.add_message(conversation_id, user_id, "user", "What are last quarter's numbers?")
-        await manager.add_message(conversation_id, user_id, "assistant", "Last quarter's numbers rose by 15%. [doc1]")
+        created_at: int = time.time_ns()
+        await asyncio.gather(
+            manager.add_message(conversation_id, user_id, "user", "How does that compare to last year?", created_at=created_at),
+            manager.add_message(
+                conversation_id, user_id, "assistant", "It is 8% higher than the same quarter last year. [doc2]",
+                created_at=created_at + 1,
+            ),
+        )
         print("\n\n")
 
         # Test 3: Retrieve conversation info
@@ -66,7 +82,7 @@ async def main() -> None:
         print("\n\n")
 
         # Test 6: List all conversations for the user
-        conversations: List[Dict[str, str]] = await manager.list_conversations(user_id, limit=10, offset=0)
+        conversations, next_token = await manager.list_conversations(user_id, limit=10)
         print("List of conversations:", conversations)
         print("\n\n")
 
@@ -91,11 +107,16 @@ async def main() -> None:
         # Ensure proper cleanup
         await manager.close()
         print("Manager closed")
+        sys.stdout.flush()
 
 if __name__ == "__main__":
 
-    # Add logging to debug unclosed resources
-    logging.basicConfig(level=logging.DEBUG)
+    # Log warnings and above by default; set LOGLEVEL=DEBUG to debug unclosed resources
+    logging.basicConfig(level=os.environ.get("LOGLEVEL", "WARNING").upper())
+
+    # Keep the Azure SDK and HTTP client quiet regardless of the test's own level
+    logging.getLogger("azure").setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
 
     # Run the main function and ensure proper cleanup
     try: